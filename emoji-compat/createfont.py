@@ -36,6 +36,12 @@ version that the emoji was added (compatAdded). Updated when the script is execu
 
 - data/emoji_metadata.fbs: The flatbuffer schema file. See http://google.github.io/flatbuffers/.
 
+The following are required to run the script:
+- fontTools Python package.
+- flatbuffers Python package, used to write the metadata binary.
+- flatc, the FlatBuffers compiler, on the PATH. Used to generate the flatbuffer java files and the
+python builders of the metadata binary from data/emoji_metadata.fbs.
+
 After execution the following files are generated if they don't exist otherwise, they are updated:
 - font/NotoColorEmojiCompat.ttf
 - supported-emojis/emojis.txt
@@ -48,13 +54,22 @@ from __future__ import print_function
 import contextlib
 import csv
 import hashlib
+import importlib
 import itertools
-import json
+import operator
 import os
+import re
 import shutil
+import struct
+import subprocess
 import sys
 import tempfile
+import flatbuffers
 from fontTools import ttLib
+from fontTools.misc import sstruct
+from fontTools.misc.fixedTools import floatToFixed
+from fontTools.ttLib.tables.BitmapGlyphMetrics import BigGlyphMetrics, SmallGlyphMetrics
+from fontTools.ttLib.tables.DefaultTable import DefaultTable
 
 ########### UPDATE OR CHECK WHEN A NEW FONT IS BEING GENERATED ###########
 # Last Android SDK Version
@@ -95,16 +110,16 @@ INPUT_META_FILE = OUTPUT_META_FILE
 FLATBUFFER_SCHEMA = os.path.join(DATA_DIR, 'emoji_metadata.fbs')
 # file path for java header, it will be prepended to flatbuffer java files
 FLATBUFFER_HEADER = os.path.join(DATA_DIR, "flatbuffer_header.txt")
-# temporary emoji metadata json output file
-OUTPUT_JSON_FILE_NAME = 'emoji_metadata.json'
-# temporary binary file generated by flatbuffer
-FLATBUFFER_BIN = 'emoji_metadata.bin'
 # directory representation for flatbuffer java package
 FLATBUFFER_PACKAGE_PATH = os.path.join('androidx', 'text', 'emoji', 'flatbuffer', '')
 # temporary directory that contains flatbuffer java files
 FLATBUFFER_JAVA_PATH = os.path.join(FLATBUFFER_PACKAGE_PATH)
 FLATBUFFER_METADATA_LIST_JAVA = "MetadataList.java"
 FLATBUFFER_METADATA_ITEM_JAVA = "MetadataItem.java"
+# python package of the flatbuffer python modules, generated by flatc along with the java files
+FLATBUFFER_PYTHON_PACKAGE = 'androidx.text.emoji.flatbuffer'
+FLATBUFFER_METADATA_LIST_MODULE = FLATBUFFER_PYTHON_PACKAGE + '.MetadataList'
+FLATBUFFER_METADATA_ITEM_MODULE = FLATBUFFER_PYTHON_PACKAGE + '.MetadataItem'
 # directory under source where flatbuffer java files will be copied into
 FLATBUFFER_JAVA_TARGET = os.path.join(JAVA_SRC_DIR, FLATBUFFER_PACKAGE_PATH)
 # meta tag name used in the font to embed the emoji metadata. This value is also used in
@@ -113,37 +128,117 @@ EMOJI_META_TAG_NAME = 'Emji'
 
 EMOJI_STR = 'EMOJI'
 EMOJI_PRESENTATION_STR = 'EMOJI_PRESENTATION'
-ACCEPTED_EMOJI_PROPERTIES = [EMOJI_PRESENTATION_STR, EMOJI_STR]
+ACCEPTED_EMOJI_PROPERTIES = frozenset([EMOJI_PRESENTATION_STR, EMOJI_STR])
 STD_VARIANTS_EMOJI_STYLE = 'EMOJI STYLE'
+BASIC_EMOJI_STR = 'BASIC_EMOJI'
+# matches the codepoints and the emoji property of an emoji-data.txt line such as
+# 1F93C..1F93E ; EMOJI_MODIFIER_BASE # [...]
+EMOJI_PROPERTY_LINE_RE = re.compile(r'\s*([0-9A-F.]+)\s*;\s*(\w+)[^#]*#')
 
 DEFAULT_EMOJI_ID = 0xF0001
 EMOJI_STYLE_VS = 0xFE0F
 
+# CBDT and CBLC table version set in the font. older android versions cannot read > 2.0
+CBDT_CBLC_VERSION = 2.0
+
+# CBDT bitmap formats that store the glyph metrics at the start of the bitmap data, and the class
+# used to read them
+CBDT_METRICS_CLASSES = {17: SmallGlyphMetrics, 18: BigGlyphMetrics}
+
+# upper estimates of the bytes used in the metadata flatbuffer by the MetadataList table, sourceSha
+# included, and by each MetadataItem excluding its codepoints. used to size the flatbuffers builder
+# up front so that its buffer is not grown and copied while the items are added.
+FLATBUFFER_LIST_SIZE_ESTIMATE = 256
+FLATBUFFER_ITEM_SIZE_ESTIMATE = 48
+
+# size of the buffer used to read the source files while creating the sha
+SHA_READ_BUFFER_SIZE = 1024 * 1024
+
+# lazy codepoint range type. range builds a full list on Python 2, xrange does not.
+try:
+    _range = xrange
+except NameError:
+    _range = range
+
+# caches for the codepoint to string conversions and back. the same few thousand codepoints are
+# converted over and over while the emoji files and the font are processed.
+_HEX_STR_CACHE = {}
+_HEX_INT_CACHE = {}
+
 def to_hex_str(value):
     """Converts given int value to hex without the 0x prefix"""
-    return format(value, 'X')
+    result = _HEX_STR_CACHE.get(value)
+    if result is None:
+        result = _HEX_STR_CACHE[value] = format(value, 'X')
+    return result
 
 def hex_str_to_int(string):
     """Convert a hex string into int"""
-    return int(string, 16)
+    result = _HEX_INT_CACHE.get(string)
+    if result is None:
+        result = _HEX_INT_CACHE[string] = int(string, 16)
+    return result
 
 def codepoint_to_string(codepoints):
     """Converts a list of codepoints into a string separated with space."""
-    return ' '.join([to_hex_str(x) for x in codepoints])
+    return ' '.join(map(to_hex_str, codepoints))
+
+def move_file(src_path, dst_path):
+    """Moves the file by renaming it. Falls back to copying the file if it cannot be renamed, i.e.
+    the paths are on different file systems."""
+    try:
+        os.rename(src_path, dst_path)
+    except OSError:
+        shutil.copy(src_path, dst_path)
+
 
 def prepend_header_to_file(file_path):
     """Prepends the header to the file. Used to update flatbuffer java files with header, comments
-    and annotations."""
-    with open(file_path, "r+") as original_file:
+    and annotations. The result is written to a new file that then replaces the original one."""
+    with open(file_path, "r") as original_file:
+        original_content = original_file.read()
+    start_index = original_content.index("public final class")
+
+    tmp_file_path = file_path + ".tmp"
+    with open(tmp_file_path, "w") as tmp_file:
         with open(FLATBUFFER_HEADER, "r") as copyright_file:
-            original_content = original_file.read()
-            start_index = original_content.index("public final class")
-            original_file.seek(0)
-            original_file.write(copyright_file.read() + "\n" + original_content[start_index:])
+            shutil.copyfileobj(copyright_file, tmp_file)
+        tmp_file.write("\n")
+        tmp_file.write(original_content[start_index:])
+    move_file(tmp_file_path, file_path)
+
+
+@contextlib.contextmanager
+def generate_flatbuffer_files():
+    """Generates flatbuffer java and python files from the schema in a temporary directory. Yields
+    the directory, which is removed on exit."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # create the flatbuffers java and python classes. flatc output is not captured, it goes to
+        # the console as is
+        subprocess.check_call(['flatc', '-o', tmp_dir, '-j', '-p', FLATBUFFER_SCHEMA])
+        yield tmp_dir
+    finally:
+        # clear the tmp output directory
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_flatbuffer_python_modules(flatbuffer_dir):
+    """Imports the MetadataList and MetadataItem python modules generated in flatbuffer_dir
+    :return: tuple of MetadataList and MetadataItem modules
+    """
+    sys.path.insert(0, flatbuffer_dir)
+    try:
+        return (importlib.import_module(FLATBUFFER_METADATA_LIST_MODULE),
+                importlib.import_module(FLATBUFFER_METADATA_ITEM_MODULE))
+    finally:
+        sys.path.remove(flatbuffer_dir)
 
 
-def update_flatbuffer_java_files(flatbuffer_java_dir):
-    """Prepends headers to flatbuffer java files and copies to the final destination"""
+def update_flatbuffer_java_files(flatbuffer_dir):
+    """Prepends headers to the flatbuffer java files generated in flatbuffer_dir and moves them to
+    the final destination"""
+    flatbuffer_java_dir = os.path.join(flatbuffer_dir, FLATBUFFER_JAVA_PATH)
     tmp_metadata_list = flatbuffer_java_dir + FLATBUFFER_METADATA_LIST_JAVA
     tmp_metadata_item = flatbuffer_java_dir + FLATBUFFER_METADATA_ITEM_JAVA
     prepend_header_to_file(tmp_metadata_list)
@@ -152,45 +247,36 @@ def update_flatbuffer_java_files(flatbuffer_java_dir):
     if not os.path.exists(FLATBUFFER_JAVA_TARGET):
         os.makedirs(FLATBUFFER_JAVA_TARGET)
 
-    shutil.copy(tmp_metadata_list, FLATBUFFER_JAVA_TARGET + FLATBUFFER_METADATA_LIST_JAVA)
-    shutil.copy(tmp_metadata_item, FLATBUFFER_JAVA_TARGET + FLATBUFFER_METADATA_ITEM_JAVA)
+    move_file(tmp_metadata_list, FLATBUFFER_JAVA_TARGET + FLATBUFFER_METADATA_LIST_JAVA)
+    move_file(tmp_metadata_item, FLATBUFFER_JAVA_TARGET + FLATBUFFER_METADATA_ITEM_JAVA)
 
 def create_test_data(unicode_path):
     """Read all the emojis in the unicode files and update the test file"""
-    lines = read_emoji_lines(os.path.join(unicode_path, EMOJI_ZWJ_FILE))
-    lines += read_emoji_lines(os.path.join(unicode_path, EMOJI_SEQ_FILE))
-
-    lines += read_emoji_lines(os.path.join(unicode_path, ANDROID_EMOJI_ZWJ_SEQ_FILE), optional=True)
-    lines += read_emoji_lines(os.path.join(unicode_path, ANDROID_EMOJIS_SEQ_FILE), optional=True)
-
-    # standardized variants contains a huge list of sequences, only read the ones that are emojis
-    # and also the ones with FE0F (emoji style)
-    standardized_variants_lines = read_emoji_lines(
-        os.path.join(unicode_path, EMOJI_VARIATION_SEQ_FILE))
-    for line in standardized_variants_lines:
-        if STD_VARIANTS_EMOJI_STYLE in line:
-            lines.append(line)
+    lines = itertools.chain(
+        read_emoji_lines(os.path.join(unicode_path, EMOJI_ZWJ_FILE)),
+        read_emoji_lines(os.path.join(unicode_path, EMOJI_SEQ_FILE)),
+        read_emoji_lines(os.path.join(unicode_path, ANDROID_EMOJI_ZWJ_SEQ_FILE), optional=True),
+        read_emoji_lines(os.path.join(unicode_path, ANDROID_EMOJIS_SEQ_FILE), optional=True),
+        # standardized variants contains a huge list of sequences, only read the ones that are
+        # emojis and also the ones with FE0F (emoji style)
+        (line for line in read_emoji_lines(os.path.join(unicode_path, EMOJI_VARIATION_SEQ_FILE))
+         if STD_VARIANTS_EMOJI_STYLE in line))
 
     emojis_set = set()
     for line in lines:
         # In unicode 12.0, "emoji-sequences.txt" contains "Basic_Emoji" session. We ignore them
         # here since we are already checking the emoji presentations with
         # emoji-variation-sequences.txt.
-        if "BASIC_EMOJI" in line:
+        if BASIC_EMOJI_STR in line:
             continue
-        codepoints = [hex_str_to_int(x) for x in line.split(';')[0].strip().split(' ')]
-        emojis_set.add(codepoint_to_string(codepoints).upper())
+        codepoints = tuple(map(hex_str_to_int, line.split(';', 1)[0].split()))
+        emojis_set.add(codepoint_to_string(codepoints))
 
-    emoji_data_lines = read_emoji_lines(os.path.join(unicode_path, EMOJI_DATA_FILE))
-    for line in emoji_data_lines:
+    for line in read_emoji_lines(os.path.join(unicode_path, EMOJI_DATA_FILE)):
         codepoints_range, emoji_property = codepoints_and_emoji_prop(line)
-        if not emoji_property in ACCEPTED_EMOJI_PROPERTIES:
-            continue
-        is_emoji_style = emoji_property == EMOJI_PRESENTATION_STR
-        if is_emoji_style:
-            codepoints = [to_hex_str(x) for x in
-                          codepoints_for_emojirange(codepoints_range)]
-            emojis_set.update(codepoints)
+        # only the codepoints with emoji style are expanded and added
+        if emoji_property == EMOJI_PRESENTATION_STR:
+            emojis_set.update(map(to_hex_str, codepoints_for_emojirange(codepoints_range)))
 
     emoji_style_exceptions = get_emoji_style_exceptions(unicode_path)
     #  finally add the android default emoji exceptions
@@ -199,8 +285,7 @@ def create_test_data(unicode_path):
     emojis_list = list(emojis_set)
     emojis_list.sort()
     with open(TEST_DATA_PATH, "w") as test_file:
-        for line in emojis_list:
-            test_file.write("%s\n" % line)
+        test_file.writelines(line + "\n" for line in emojis_list)
 
 class _EmojiData(object):
     """Holds the information about a single emoji."""
@@ -223,24 +308,32 @@ class _EmojiData(object):
 
     def __repr__(self):
         return '<EmojiData {0} - {1}>'.format(self.emoji_style,
-                                              codepoint_to_string(self.codepoints))
-
-    def create_json_element(self):
-        """Creates the json representation of EmojiData."""
-        json_element = {}
-        json_element['id'] = self.emoji_id
-        json_element['emojiStyle'] = self.emoji_style
-        json_element['sdkAdded'] = self.sdk_added
-        json_element['compatAdded'] = self.compat_added
-        json_element['width'] = self.width
-        json_element['height'] = self.height
-        json_element['codepoints'] = self.codepoints
-        return json_element
+                                              codepoint_to_string(tuple(self.codepoints)))
+
+    def create_flatbuffer_item(self, builder, metadata_item):
+        """Creates the MetadataItem representation of EmojiData in the flatbuffers builder.
+        :param metadata_item: MetadataItem module generated by flatc
+        :return: offset of the MetadataItem in the builder
+        """
+        metadata_item.MetadataItemStartCodepointsVector(builder, len(self.codepoints))
+        for codepoint in reversed(self.codepoints):
+            builder.PrependInt32(codepoint)
+        codepoints = builder.EndVector()
+
+        metadata_item.MetadataItemStart(builder)
+        metadata_item.MetadataItemAddCodepoints(builder, codepoints)
+        metadata_item.MetadataItemAddId(builder, self.emoji_id)
+        metadata_item.MetadataItemAddHeight(builder, self.height)
+        metadata_item.MetadataItemAddWidth(builder, self.width)
+        metadata_item.MetadataItemAddCompatAdded(builder, self.compat_added)
+        metadata_item.MetadataItemAddSdkAdded(builder, self.sdk_added)
+        metadata_item.MetadataItemAddEmojiStyle(builder, self.emoji_style)
+        return metadata_item.MetadataItemEnd(builder)
 
     def create_txt_row(self):
         """Creates array of values for CSV of EmojiData."""
         row = [to_hex_str(self.emoji_id), self.sdk_added, self.compat_added]
-        row += [to_hex_str(x) for x in self.codepoints]
+        row += map(to_hex_str, self.codepoints)
         return row
 
     def update(self, emoji_id, sdk_added, compat_added):
@@ -251,26 +344,26 @@ class _EmojiData(object):
 
 
 def read_emoji_lines(file_path, optional=False):
-    """Read all lines in an unicode emoji file into a list of uppercase strings. Ignore the empty
-    lines and comments
+    """Read the lines in an unicode emoji file as uppercase strings. Ignore the empty lines and
+    comments
     :param file_path: unicode emoji file path
     :param optional: if True no exception is raised when the file cannot be read
-    :return: list of uppercase strings
+    :return: generator of uppercase strings
     """
-    result = []
     try:
+        # read and uppercase the whole file at once, so that the per line work is limited to
+        # strip and the comment check
         with open(file_path) as file_stream:
-            for line in file_stream:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    result.append(line.upper())
+            content = file_stream.read().upper()
     except IOError:
         if optional:
-            pass
-        else:
-            raise
+            return
+        raise
 
-    return result
+    for line in content.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
 
 def get_emoji_style_exceptions(unicode_path):
     """Read EMOJI_STYLE_OVERRIDE_FILE and return the codepoints as integers"""
@@ -282,33 +375,23 @@ def get_emoji_style_exceptions(unicode_path):
     return exceptions
 
 def codepoints_for_emojirange(codepoints_range):
-    """ Return codepoints given in emoji files. Expand the codepoints that are given as a range
-    such as XYZ ... UVT
+    """ Return an iterable of codepoints given in emoji files. Expand the codepoints that are given
+    as a range such as XYZ ... UVT
     """
-    codepoints = []
     if '..' in codepoints_range:
         range_start, range_end = codepoints_range.split('..')
-        codepoints_range = range(hex_str_to_int(range_start),
-                                 hex_str_to_int(range_end) + 1)
-        codepoints.extend(codepoints_range)
-    else:
-        codepoints.append(hex_str_to_int(codepoints_range))
-    return codepoints
+        return _range(hex_str_to_int(range_start), hex_str_to_int(range_end) + 1)
+    return (hex_str_to_int(codepoints_range),)
 
 def codepoints_and_emoji_prop(line):
     """For a given emoji file line, return codepoints and emoji property in the line.
     1F93C..1F93E ; [Emoji|Emoji_Presentation|Emoji_Modifier_Base|Emoji_Component
     |Extended_Pictographic] # [...]"""
-    line = line.strip()
-    if '#' in line:
-        line = line[:line.index('#')]
-    else:
-        raise ValueError("Line is expected to have # in it")
-    line = line.split(';')
-    codepoints_range = line[0].strip()
-    emoji_property = line[1].strip()
-
-    return codepoints_range, emoji_property
+    match = EMOJI_PROPERTY_LINE_RE.match(line)
+    if not match:
+        raise ValueError("Line is expected to be in 'codepoints ; property # comment' format: "
+                         + line)
+    return match.group(1), match.group(2)
 
 def read_emoji_intervals(emoji_data_map, file_path, emoji_style_exceptions):
     """Read unicode lines of unicode emoji file in which each line describes a set of codepoint
@@ -317,25 +400,28 @@ def read_emoji_intervals(emoji_data_map, file_path, emoji_style_exceptions):
     1F93C..1F93E ; [Emoji|Emoji_Presentation|Emoji_Modifier_Base|Emoji_Component
     |Extended_Pictographic] # [...]"""
     lines = read_emoji_lines(file_path)
+    # the lookups below are done for every codepoint in the expanded intervals
+    emoji_style_exceptions = frozenset(emoji_style_exceptions)
+    get_emoji_data = emoji_data_map.get
 
     for line in lines:
         codepoints_range, emoji_property = codepoints_and_emoji_prop(line)
-        if not emoji_property in ACCEPTED_EMOJI_PROPERTIES:
+        if emoji_property not in ACCEPTED_EMOJI_PROPERTIES:
             continue
         is_emoji_style = emoji_property == EMOJI_PRESENTATION_STR
         codepoints = codepoints_for_emojirange(codepoints_range)
 
         for codepoint in codepoints:
-            key = codepoint_to_string([codepoint])
+            key = (codepoint,)
             codepoint_is_emoji_style = is_emoji_style or codepoint in emoji_style_exceptions
-            if key in emoji_data_map:
+            emoji_data = get_emoji_data(key)
+            if emoji_data is not None:
                 # since there are multiple definitions of emojis, only update when emoji style is
                 # True
                 if codepoint_is_emoji_style:
-                    emoji_data_map[key].emoji_style = True
+                    emoji_data.emoji_style = True
             else:
-                emoji_data = _EmojiData([codepoint], codepoint_is_emoji_style)
-                emoji_data_map[key] = emoji_data
+                emoji_data_map[key] = _EmojiData(key, codepoint_is_emoji_style)
 
 
 def read_emoji_sequences(emoji_data_map, file_path, optional=False):
@@ -347,19 +433,18 @@ def read_emoji_sequences(emoji_data_map, file_path, optional=False):
         # In unicode 12.0, "emoji-sequences.txt" contains "Basic_Emoji" session. We ignore them
         # here since we are already checking the emoji presentations with
         # emoji-variation-sequences.txt.
-        if "BASIC_EMOJI" in line:
+        if BASIC_EMOJI_STR in line:
             continue
-        codepoints = [hex_str_to_int(x) for x in line.split(';')[0].strip().split(' ')]
-        codepoints = [x for x in codepoints if x != EMOJI_STYLE_VS]
-        key = codepoint_to_string(codepoints)
-        if not key in emoji_data_map:
+        codepoints = tuple(x for x in map(hex_str_to_int, line.split(';', 1)[0].split())
+                           if x != EMOJI_STYLE_VS)
+        if not codepoints in emoji_data_map:
             emoji_data = _EmojiData(codepoints, False)
-            emoji_data_map[key] = emoji_data
+            emoji_data_map[codepoints] = emoji_data
 
 
 def load_emoji_data_map(unicode_path):
-    """Reads the emoji data files, constructs a map of space separated codepoints to EmojiData.
-    :return: map of space separated codepoints to EmojiData
+    """Reads the emoji data files, constructs a map of codepoint tuples to EmojiData.
+    :return: map of codepoint tuples to EmojiData
     """
     emoji_data_map = {}
     emoji_style_exceptions = get_emoji_style_exceptions(unicode_path)
@@ -387,15 +472,15 @@ def load_previous_metadata(emoji_data_map):
     if os.path.isfile(INPUT_META_FILE):
         with open(INPUT_META_FILE) as csvfile:
             reader = csv.reader(csvfile, delimiter=' ')
+            get_emoji_data = emoji_data_map.get
             for row in reader:
                 if row[0].startswith('#'):
                     continue
                 emoji_id = hex_str_to_int(row[0])
                 sdk_added = int(row[1])
                 compat_added = int(row[2])
-                key = codepoint_to_string(hex_str_to_int(x) for x in row[3:])
-                if key in emoji_data_map:
-                    emoji_data = emoji_data_map[key]
+                emoji_data = get_emoji_data(tuple(map(hex_str_to_int, row[3:])))
+                if emoji_data is not None:
                     emoji_data.update(emoji_id, sdk_added, compat_added)
                     if emoji_data.emoji_id >= current_emoji_id:
                         current_emoji_id = emoji_data.emoji_id + 1
@@ -417,18 +502,26 @@ def update_ttlib_orig_sort():
     ttLib.sortedTagList = meta_first_table_sort
 
 
-def inject_meta_into_font(ttf, flatbuffer_bin_filename):
+def inject_meta_into_font(ttf, flatbuffer_bin):
     """inject metadata binary into font"""
     if not 'meta' in ttf:
         ttf['meta'] = ttLib.getTableClass('meta')()
     meta = ttf['meta']
-    with open(flatbuffer_bin_filename) as flatbuffer_bin_file:
-        meta.data[EMOJI_META_TAG_NAME] = flatbuffer_bin_file.read()
+    meta.data[EMOJI_META_TAG_NAME] = flatbuffer_bin
 
     # sort meta tables for faster access
     update_ttlib_orig_sort()
 
 
+def set_table_binary_version(ttf, tag, version):
+    """Overwrites the 16.16 fixed version at the start of a table in its binary form. The table is
+    replaced by a DefaultTable holding the patched binary, therefore it is saved without being
+    decompiled and compiled."""
+    table = DefaultTable(tag)
+    table.data = struct.pack('>l', floatToFixed(version, 16)) + ttf.getTableData(tag)[4:]
+    ttf[tag] = table
+
+
 def validate_input_files(font_path, unicode_path):
     """Validate the existence of font file and the unicode files"""
     if not os.path.isfile(font_path):
@@ -447,9 +540,35 @@ def validate_input_files(font_path, unicode_path):
 
 
 def add_file_to_sha(sha_algo, file_path):
+    """Updates sha_algo with the contents of the file"""
     with open(file_path, 'rb') as input_file:
-        for data in iter(lambda: input_file.read(8192), ''):
-            sha_algo.update(data)
+        buf = bytearray(SHA_READ_BUFFER_SIZE)
+        view = memoryview(buf)
+        size = input_file.readinto(buf)
+        while size:
+            sha_algo.update(view[:size])
+            size = input_file.readinto(buf)
+
+def read_bitmap_metrics(bitmap):
+    """Returns the metrics of a CBDT bitmap. If the bitmap is not decompiled yet and stores its
+    metrics in the bitmap data, only the metrics header is read and the image data is left as is.
+    """
+    data = getattr(bitmap, 'data', None)
+    metrics_class = CBDT_METRICS_CLASSES.get(bitmap.getFormat())
+    if data is None or metrics_class is None:
+        return bitmap.metrics
+    metrics = metrics_class()
+    sstruct.unpack(metrics_class.binaryFormat,
+                   data[:sstruct.calcsize(metrics_class.binaryFormat)], metrics)
+    return metrics
+
+def estimate_flatbuffer_size(emoji_data_list):
+    """Returns the initial size for the builder of the metadata flatbuffer, rounded up to a power
+    of two"""
+    size = FLATBUFFER_LIST_SIZE_ESTIMATE
+    for emoji_data in emoji_data_list:
+        size += FLATBUFFER_ITEM_SIZE_ESTIMATE + 4 * len(emoji_data.codepoints)
+    return 1 << (size - 1).bit_length()
 
 def create_sha_from_source_files(font_paths):
     """Creates a SHA from the given font files"""
@@ -468,6 +587,8 @@ class EmojiFontCreator(object):
         self.font_path = font_path
         self.unicode_path = unicode_path
         self.emoji_data_map = {}
+        # values of emoji_data_map sorted by emoji id, set once all emoji data is updated
+        self.emoji_data_list = []
         self.remapped_codepoints = {}
         self.glyph_to_image_metrics_map = {}
         # set default emoji id to start of Supplemental Private Use Area-A
@@ -477,10 +598,9 @@ class EmojiFontCreator(object):
         """Updates the existing EmojiData identified with codepoints. The fields that are set are:
         - emoji_id (if it does not exist)
         - image width/height"""
-        key = codepoint_to_string(codepoints)
-        if key in self.emoji_data_map:
+        emoji_data = self.emoji_data_map.get(tuple(codepoints))
+        if emoji_data is not None:
             # add emoji to final data
-            emoji_data = self.emoji_data_map[key]
             emoji_data.update_metrics(self.glyph_to_image_metrics_map[glyph_name])
             if emoji_data.emoji_id == 0:
                 emoji_data.emoji_id = self.emoji_id
@@ -488,12 +608,13 @@ class EmojiFontCreator(object):
             self.remapped_codepoints[emoji_data.emoji_id] = glyph_name
 
     def read_cbdt(self, ttf):
-        """Read image size data from CBDT."""
-        cbdt = ttf['CBDT']
+        """Read image size data from CBDT. The table is decompiled on its own instead of through
+        ttf, so that ttf saves the original CBDT binary without recompiling the bitmaps."""
+        cbdt = ttLib.newTable('CBDT')
+        cbdt.decompile(ttf.getTableData('CBDT'), ttf)
         for strike_data in cbdt.strikeData:
             for key, data in strike_data.iteritems():
-                data.decompile()
-                self.glyph_to_image_metrics_map[key] = data.metrics
+                self.glyph_to_image_metrics_map[key] = read_bitmap_metrics(data)
 
     def read_cmap12(self, ttf, glyph_to_codepoint_map):
         """Reads single code point emojis that are in cmap12, updates glyph_to_codepoint_map and
@@ -540,13 +661,13 @@ class EmojiFontCreator(object):
                                                                             record.LookupListIndex)
                     # create combinations or all lists. the combinations will be filtered by
                     # emoji_data_map. the first element that contain as a valid glyph will be used
-                    # as the final glyph
-                    combinations = list(itertools.product(*subs_list))
-                    for seq in combinations:
+                    # as the final glyph. combinations are iterated lazily since their count is the
+                    # product of the substitution list sizes.
+                    for seq in itertools.product(*subs_list):
                         glyph_names = [x["input"] for x in seq]
                         codepoints = [glyph_to_codepoint_map[x] for x in glyph_names]
-                        outputs = [x["output"] for x in seq if x["output"]]
-                        nonempty_outputs = filter(lambda x: x.strip() , outputs)
+                        nonempty_outputs = [x["output"] for x in seq
+                                            if x["output"] and x["output"].strip()]
                         if len(nonempty_outputs) == 0:
                             print("Warning: no output glyph is set for " + str(glyph_names))
                             continue
@@ -572,37 +693,37 @@ class EmojiFontCreator(object):
                 codepoints = [glyph_to_codepoint_map[x] for x in glyph_names]
                 self.update_emoji_data(codepoints, ligature.LigGlyph)
 
-    def write_metadata_json(self, output_json_file_path):
-        """Writes the emojis into a json file"""
-        output_json = {}
-        output_json['version'] = METADATA_VERSION
-        output_json['sourceSha'] = create_sha_from_source_files(
+    def create_metadata_flatbuffer(self, flatbuffer_dir):
+        """Creates the FlatBuffers binary of the emojis using the python modules generated by flatc.
+        :param flatbuffer_dir: directory that contains the generated flatbuffer files
+        :return: FlatBuffers binary as bytes
+        """
+        metadata_list, metadata_item = load_flatbuffer_python_modules(flatbuffer_dir)
+        source_sha = create_sha_from_source_files(
             [self.font_path, OUTPUT_META_FILE, FLATBUFFER_SCHEMA])
-        output_json['list'] = []
-
-        emoji_data_list = sorted(self.emoji_data_map.values(), key=lambda x: x.emoji_id)
-
-        total_emoji_count = 0
-        for emoji_data in emoji_data_list:
-            element = emoji_data.create_json_element()
-            output_json['list'].append(element)
-            total_emoji_count = total_emoji_count + 1
 
-        # write the new json file to be processed by FlatBuffers
-        with open(output_json_file_path, 'w') as json_file:
-            print(json.dumps(output_json, indent=4, sort_keys=True, separators=(',', ':')),
-                  file=json_file)
-
-        return total_emoji_count
+        builder = flatbuffers.Builder(estimate_flatbuffer_size(self.emoji_data_list))
+        source_sha = builder.CreateString(source_sha)
+        items = [emoji_data.create_flatbuffer_item(builder, metadata_item)
+                 for emoji_data in self.emoji_data_list]
+        metadata_list.MetadataListStartListVector(builder, len(items))
+        for item in reversed(items):
+            builder.PrependUOffsetTRelative(item)
+        item_list = builder.EndVector()
+
+        metadata_list.MetadataListStart(builder)
+        metadata_list.MetadataListAddSourceSha(builder, source_sha)
+        metadata_list.MetadataListAddList(builder, item_list)
+        metadata_list.MetadataListAddVersion(builder, METADATA_VERSION)
+        builder.Finish(metadata_list.MetadataListEnd(builder))
+        return bytes(builder.Output())
 
     def write_metadata_csv(self):
         """Writes emoji metadata into space separated file"""
         with open(OUTPUT_META_FILE, 'w') as csvfile:
             csvwriter = csv.writer(csvfile, delimiter=' ')
-            emoji_data_list = sorted(self.emoji_data_map.values(), key=lambda x: x.emoji_id)
             csvwriter.writerow(['#id', 'sdkAdded', 'compatAdded', 'codepoints'])
-            for emoji_data in emoji_data_list:
-                csvwriter.writerow(emoji_data.create_txt_row())
+            csvwriter.writerows(emoji_data.create_txt_row() for emoji_data in self.emoji_data_list)
 
     def create_font(self):
         """Creates the EmojiCompat font.
@@ -610,67 +731,62 @@ class EmojiFontCreator(object):
         :param unicode_path: path to directory that contains unicode files
         """
 
-        tmp_dir = tempfile.mkdtemp()
-
-        # create emoji codepoints to EmojiData map
-        self.emoji_data_map = load_emoji_data_map(self.unicode_path)
-
-        # read previous metadata file to update id, sdkAdded and compatAdded. emoji id that is
-        # returned is either default or 1 greater than the largest id in previous data
-        self.emoji_id = load_previous_metadata(self.emoji_data_map)
-
-        # recalcTimestamp parameter will keep the modified field same as the original font. Changing
-        # the modified field in the font causes the font ttf file to change, which makes it harder
-        # to understand if something really changed in the font.
-        with contextlib.closing(ttLib.TTFont(self.font_path, recalcTimestamp=False)) as ttf:
-            # read image size data
-            self.read_cbdt(ttf)
-
-            # glyph name to codepoint map
-            glyph_to_codepoint_map = {}
+        # generate the flatbuffer java and python files first, flatc fails on an invalid schema
+        # before any of the output files are updated
+        with generate_flatbuffer_files() as flatbuffer_dir:
+            # create emoji codepoints to EmojiData map
+            self.emoji_data_map = load_emoji_data_map(self.unicode_path)
 
-            # read single codepoint emojis under cmap12 and clear the table contents
-            cmap12_table = self.read_cmap12(ttf, glyph_to_codepoint_map)
+            # read previous metadata file to update id, sdkAdded and compatAdded. emoji id that is
+            # returned is either default or 1 greater than the largest id in previous data
+            self.emoji_id = load_previous_metadata(self.emoji_data_map)
 
-            # read emoji sequences gsub and clear the table contents
-            self.read_gsub(ttf, glyph_to_codepoint_map)
+            # recalcTimestamp parameter will keep the modified field same as the original font.
+            # Changing the modified field in the font causes the font ttf file to change, which
+            # makes it harder to understand if something really changed in the font. lazy parameter
+            # defers decompiling the tables and their subtables until they are accessed, only a few
+            # of them are used here and the rest are copied as is when the font is saved.
+            with contextlib.closing(ttLib.TTFont(self.font_path, recalcTimestamp=False,
+                                                 lazy=True)) as ttf:
+                # read image size data
+                self.read_cbdt(ttf)
 
-            # add all new codepoint to glyph mappings
-            cmap12_table.cmap.update(self.remapped_codepoints)
+                # glyph name to codepoint map
+                glyph_to_codepoint_map = {}
 
-            # final metadata csv will be used to generate the sha, therefore write it before
-            # metadata json is written.
-            self.write_metadata_csv()
+                # read single codepoint emojis under cmap12 and clear the table contents
+                cmap12_table = self.read_cmap12(ttf, glyph_to_codepoint_map)
 
-            output_json_file = os.path.join(tmp_dir, OUTPUT_JSON_FILE_NAME)
-            flatbuffer_bin_file = os.path.join(tmp_dir, FLATBUFFER_BIN)
-            flatbuffer_java_dir = os.path.join(tmp_dir, FLATBUFFER_JAVA_PATH)
+                # read emoji sequences gsub and clear the table contents
+                self.read_gsub(ttf, glyph_to_codepoint_map)
 
-            total_emoji_count = self.write_metadata_json(output_json_file)
+                # add all new codepoint to glyph mappings
+                cmap12_table.cmap.update(self.remapped_codepoints)
 
-            # create the flatbuffers binary and java classes
-            sys_command = 'flatc -o {0} -b -j {1} {2}'
-            os.system(sys_command.format(tmp_dir, FLATBUFFER_SCHEMA, output_json_file))
+                # emoji data is final at this point, sort it once for the metadata writers
+                self.emoji_data_list = sorted(self.emoji_data_map.values(),
+                                              key=operator.attrgetter('emoji_id'))
 
-            # inject metadata binary into font
-            inject_meta_into_font(ttf, flatbuffer_bin_file)
+                # final metadata csv will be used to generate the sha, therefore write it before
+                # metadata flatbuffer is written.
+                self.write_metadata_csv()
 
-            # update CBDT and CBLC versions since older android versions cannot read > 2.0
-            ttf['CBDT'].version = 2.0
-            ttf['CBLC'].version = 2.0
+                # inject metadata binary into font
+                inject_meta_into_font(ttf, self.create_metadata_flatbuffer(flatbuffer_dir))
 
-            # save the new font
-            ttf.save(FONT_PATH)
+                # update CBDT and CBLC versions since older android versions cannot read > 2.0
+                set_table_binary_version(ttf, 'CBDT', CBDT_CBLC_VERSION)
+                ttf['CBLC'].version = CBDT_CBLC_VERSION
 
-            update_flatbuffer_java_files(flatbuffer_java_dir)
+                # save the new font
+                ttf.save(FONT_PATH)
 
-            create_test_data(self.unicode_path)
+                update_flatbuffer_java_files(flatbuffer_dir)
 
-            # clear the tmp output directory
-            shutil.rmtree(tmp_dir, ignore_errors=True)
+                create_test_data(self.unicode_path)
 
-            print(
-                "{0} emojis are written to\n{1}".format(total_emoji_count, FONT_DIR))
+                print(
+                    "{0} emojis are written to\n{1}".format(len(self.emoji_data_list), FONT_DIR))
 
 
 def print_usage():
@@ -679,8 +795,15 @@ def print_usage():
           "usage: createfont.py noto-color-emoji-path unicode-dir-path")
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
+def main(argv):
+    """Creates the EmojiCompat font from the font and unicode paths in argv."""
+    try:
+        font_path, unicode_path = argv[1], argv[2]
+    except IndexError:
         print_usage()
         sys.exit(1)
-    EmojiFontCreator(sys.argv[1], sys.argv[2]).create_font()
+    EmojiFontCreator(font_path, unicode_path).create_font()
+
+
+if __name__ == '__main__':
+    main(sys.argv)